@@ -1,8 +1,16 @@
 import os
-import json
+import sys
+import hashlib
+import threading
+import time
+import msgspec
+import orjson
 import requests
-import xml.etree.ElementTree as ET
-from xml.dom import minidom
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from lxml import etree as ET
+from xml.sax.saxutils import escape as xml_escape, quoteattr
 from datetime import datetime
 
 # ==============================================================================
@@ -21,76 +29,187 @@ PRODUCTS_API = {
 
 CATEGORIES_API_URL = f"{BASE_URL}/categories"
 
+# Таймауты для всех HTTP-запросов: (соединение, чтение)
+REQUEST_TIMEOUT = (5, 60)
+
+# Общая сессия с пулом соединений (keep-alive): все запросы идут на один хост,
+# поэтому переиспользуем TCP/TLS-соединение вместо нового handshake на каждый вызов.
+# POST-ы к API идемпотентны (чтение каталога), поэтому их тоже можно ретраить.
+SESSION = requests.Session()
+# Просим и brotli (пакет brotli установлен): большой JSON каталога ужимается заметно сильнее gzip
+SESSION.headers["Accept-Encoding"] = "gzip, br, deflate"
+SESSION.mount("https://", HTTPAdapter(
+    pool_connections=4,
+    pool_maxsize=8,
+    max_retries=Retry(
+        total=3,
+        backoff_factor=0.5,
+        status_forcelist=[502, 503, 504],
+        allowed_methods=["GET", "POST"]
+    )
+))
+
 # ==============================================================================
 # ФУНКЦИЯ ДЛЯ ВЫПОЛНЕНИЯ API-ЗАПРОСА
 # ==============================================================================
-def fetch_data(url, is_post=False, payload=None):
+def fetch_data(url):
     """
-    Выполняет HTTP-запрос (GET или POST) к API Prompower.
+    Выполняет GET-запрос к API Prompower (категории).
+    Ответ кешируется на диске (см. _cached_request).
+    Продукты запрашиваются отдельно POST-ом в fetch_products.
     """
-    headers = {"Content-Type": "application/json"}
-    
-    if is_post:
-        if not API_EMAIL or not API_KEY:
-            print("Ошибка: Секреты API_EMAIL или API_KEY не найдены для POST-запроса.")
-            return None
-        
-        post_payload = {
-            "email": API_EMAIL,
-            "key": API_KEY,
-            "format": "json" 
-        }
-        if payload:
-            post_payload.update(payload)
-            
+    def do_request():
         try:
-            response = requests.post(url, headers=headers, data=json.dumps(post_payload))
-        except requests.exceptions.RequestException as e:
-            print(f"Ошибка при выполнении POST-запроса к {url}: {e}")
+            response = SESSION.get(url, headers={"Content-Type": "application/json"}, timeout=REQUEST_TIMEOUT)
+            response.raise_for_status()
+        except requests.exceptions.HTTPError as e:
+            print(f"HTTP Ошибка при получении данных от {url}: {e}")
+            print(f"Ответ сервера: {response.text}")
             return None
-    else: # GET-запрос для категорий
-        try:
-            response = requests.get(url, headers=headers)
         except requests.exceptions.RequestException as e:
             print(f"Ошибка при выполнении GET-запроса к {url}: {e}")
             return None
+        return response.content
 
-    try:
-        response.raise_for_status()
-        return response.json()
-    except requests.exceptions.HTTPError as e:
-        print(f"HTTP Ошибка при получении данных от {url}: {e}")
-        print(f"Ответ сервера: {response.text}")
+    body = _cached_request(url, do_request)
+    if body is None:
         return None
-    except json.JSONDecodeError:
-        print(f"Ошибка декодирования JSON для {url}. Ответ: {response.text[:200]}...")
+
+    try:
+        # orjson разбирает ответ заметно быстрее стандартного json
+        return orjson.loads(body)
+    except orjson.JSONDecodeError:
+        print(f"Ошибка декодирования JSON для {url}. Ответ: {body[:200]}...")
         return None
 
 # ==============================================================================
 # ФУНКЦИЯ ДЛЯ ЗАГРУЗКИ КАРТИНОК ИЗ ВНЕШНЕГО XML
 # ==============================================================================
+# Кеш внешнего feed.xml между запусками (в Actions восстанавливается через
+# actions/cache): при неизменном файле сервер ответит 304 без тела
+CACHE_DIR = ".feed_cache"
+EXTERNAL_FEED_CACHE = os.path.join(CACHE_DIR, "external_feed.xml")
+EXTERNAL_FEED_META = os.path.join(CACHE_DIR, "external_feed.meta.json")
+
+# TTL-кеш ответов API: пока ответ моложе FEED_CACHE_TTL секунд, повторный
+# запуск (например, частый cron) вообще не ходит в сеть. 0 отключает кеш.
+API_CACHE_TTL = int(os.environ.get("FEED_CACHE_TTL", "3600"))
+API_CACHE_STATE = os.path.join(CACHE_DIR, "api_state.json")
+# Запросы идут из нескольких потоков — не даем им потерять записи друг друга
+_API_STATE_LOCK = threading.Lock()
+
+def _load_api_state():
+    """
+    Читает состояние кеша API (хеши и отметки времени ответов).
+    """
+    try:
+        with open(API_CACHE_STATE, "rb") as f:
+            return orjson.loads(f.read())
+    except (OSError, orjson.JSONDecodeError):
+        return {}
+
+def _save_api_state(state):
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    with open(API_CACHE_STATE, "wb") as f:
+        f.write(orjson.dumps(state))
+
+def _api_cache_path(url):
+    return os.path.join(CACHE_DIR, "api_" + hashlib.sha256(url.encode()).hexdigest()[:16] + ".body")
+
+def _cached_request(url, do_request):
+    """
+    Возвращает тело ответа для url: свежую копию из кеша, если она моложе
+    API_CACHE_TTL, иначе результат do_request() (и обновляет кеш + sha256-хеш,
+    по которому потом решаем, менялись ли данные).
+    """
+    with _API_STATE_LOCK:
+        entry = _load_api_state().get(url)
+
+    if entry and API_CACHE_TTL > 0 and time.time() - entry.get("ts", 0) < API_CACHE_TTL:
+        try:
+            with open(_api_cache_path(url), "rb") as f:
+                body = f.read()
+            print(f"Используем кешированный ответ для {url}.")
+            return body
+        except OSError:
+            pass # кеш-файл потерялся — идем в сеть
+
+    body = do_request()
+    if body is None:
+        return None
+
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    with open(_api_cache_path(url), "wb") as f:
+        f.write(body)
+    with _API_STATE_LOCK:
+        state = _load_api_state()
+        state[url] = {"hash": hashlib.sha256(body).hexdigest(), "ts": time.time()}
+        _save_api_state(state)
+    return body
+
+def _load_external_feed_meta():
+    """
+    Читает сохраненные ETag/Last-Modified прошлого скачивания (если есть).
+    """
+    if not (os.path.exists(EXTERNAL_FEED_CACHE) and os.path.exists(EXTERNAL_FEED_META)):
+        return {}
+    try:
+        with open(EXTERNAL_FEED_META, "rb") as f:
+            return orjson.loads(f.read())
+    except (OSError, orjson.JSONDecodeError):
+        return {}
+
 def fetch_external_images_map():
     """
     Скачивает feed.xml с prompower.ru и создает словарь {offer_id: picture_url}.
     """
     print(f"Загрузка внешнего XML для картинок: {EXTERNAL_FEED_URL}...")
+
+    # Условный GET: если файл не менялся, сервер вернет 304 и мы
+    # разбираем локальную копию вместо повторного скачивания
+    meta = _load_external_feed_meta()
+    headers = {}
+    if meta.get("etag"):
+        headers["If-None-Match"] = meta["etag"]
+    if meta.get("last_modified"):
+        headers["If-Modified-Since"] = meta["last_modified"]
+
     try:
-        response = requests.get(EXTERNAL_FEED_URL)
+        response = SESSION.get(EXTERNAL_FEED_URL, headers=headers, stream=True, timeout=REQUEST_TIMEOUT)
         response.raise_for_status()
-        
-        # Парсим XML
-        root = ET.fromstring(response.content)
-        
+
+        if response.status_code == 304:
+            print("Внешний XML не изменился (304) — используем кешированную копию.")
+        else:
+            # Отдаем urllib3 сырой поток уже распакованным (gzip) и пишем
+            # в кеш кусками, не загружая весь XML в память
+            response.raw.decode_content = True
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            with open(EXTERNAL_FEED_CACHE, "wb") as f:
+                for chunk in iter(lambda: response.raw.read(65536), b""):
+                    f.write(chunk)
+
+            new_meta = {}
+            if response.headers.get("ETag"):
+                new_meta["etag"] = response.headers["ETag"]
+            if response.headers.get("Last-Modified"):
+                new_meta["last_modified"] = response.headers["Last-Modified"]
+            with open(EXTERNAL_FEED_META, "wb") as f:
+                f.write(orjson.dumps(new_meta))
+
         images_map = {}
-        # Ищем все теги offer
-        for offer in root.findall(".//offer"):
-            offer_id = offer.get("id")
-            picture_tag = offer.find("picture")
-            
-            if offer_id and picture_tag is not None and picture_tag.text:
+        # Потоковый разбор: держим в памяти только текущий offer, а не весь DOM
+        with open(EXTERNAL_FEED_CACHE, "rb") as feed_file:
+            for event, elem in ET.iterparse(feed_file, events=("end",), tag="offer"):
                 # Сохраняем в словарь: Ключ - ID, Значение - URL картинки
-                images_map[offer_id] = picture_tag.text.strip()
-                
+                if (offer_id := elem.get("id")) and (picture := elem.findtext("picture")):
+                    images_map[offer_id] = picture.strip()
+
+                # Освобождаем разобранный offer и уже обработанных соседей
+                elem.clear()
+                while elem.getprevious() is not None:
+                    del elem.getparent()[0]
+
         print(f"Успешно загружено {len(images_map)} изображений из внешнего XML.")
         return images_map
 
@@ -101,179 +220,332 @@ def fetch_external_images_map():
 # ==============================================================================
 # ФУНКЦИЯ ДЛЯ ПОЛУЧЕНИЯ ВСЕХ ПРОДУКТОВ
 # ==============================================================================
-def fetch_all_products():
+class Product(msgspec.Struct):
     """
-    Получает продукты Prompower и UniMAT и добавляет поле 'source_brand'.
+    Схема продукта из API. msgspec декодирует JSON сразу в типизированные
+    структуры: это быстрее dict-ов, а доступ к полю дешевле dict.get.
+    Незнакомые поля ответа просто игнорируются.
     """
-    all_products = []
-    
-    for brand_name, api_url in PRODUCTS_API.items():
-        print(f"Загрузка продуктов для бренда: {brand_name}...")
-        products_data = fetch_data(api_url, is_post=True)
-        
-        if not products_data:
-            print(f"Не удалось получить продукты для {brand_name}. Пропускаем.")
-            continue
-            
-        product_list = products_data if isinstance(products_data, list) else products_data.get("products", [])
-        
-        # Добавляем поле для определения бренда/вендора при генерации XML
-        for product in product_list:
-            product['source_brand'] = brand_name
-        
-        all_products.extend(product_list)
-        print(f"Загружено {len(product_list)} продуктов для {brand_name}.")
-
-    return all_products
+    article: str | int | None = None
+    title: str | None = None
+    categoryId: str | int | float | None = "10"
+    price: str | int | float | None = 0
+    instock: str | int | float | None = 0
+    picture: str | None = None
+    image: str | None = None
+    description: str | None = None
+    weight: str | int | float | None = None
+    height: str | int | float | None = None
+    width: str | int | float | None = None
+    depth: str | int | float | None = None
+
+class _ProductsEnvelope(msgspec.Struct):
+    products: list[Product] = []
+
+def fetch_products(url):
+    """
+    Получает список продуктов из POST-ответа API, декодируя его в Product.
+    """
+    if not API_EMAIL or not API_KEY:
+        print("Ошибка: Секреты API_EMAIL или API_KEY не найдены для POST-запроса.")
+        return []
+
+    post_payload = {
+        "email": API_EMAIL,
+        "key": API_KEY,
+        "format": "json"
+    }
+
+    def do_request():
+        try:
+            response = SESSION.post(
+                url,
+                headers={"Content-Type": "application/json"},
+                data=orjson.dumps(post_payload),
+                timeout=REQUEST_TIMEOUT
+            )
+            response.raise_for_status()
+        except requests.exceptions.HTTPError as e:
+            print(f"HTTP Ошибка при получении данных от {url}: {e}")
+            print(f"Ответ сервера: {response.text}")
+            return None
+        except requests.exceptions.RequestException as e:
+            print(f"Ошибка при выполнении POST-запроса к {url}: {e}")
+            return None
+        return response.content
+
+    body = _cached_request(url, do_request)
+    if body is None:
+        return []
+
+    # Ответ бывает и голым списком, и объектом {"products": [...]}
+    try:
+        if body.lstrip()[:1] == b"[":
+            return msgspec.json.decode(body, type=list[Product])
+        return msgspec.json.decode(body, type=_ProductsEnvelope).products
+    except msgspec.DecodeError as e:
+        print(f"Ошибка декодирования JSON для {url}: {e}")
+        return []
+
+def fetch_all_products(brand_futures):
+    """
+    Собирает продукты обоих брендов из уже запущенных запросов.
+    """
+    products_by_brand = {}
+    for brand_name, future in brand_futures.items():
+        products = future.result()
+        products_by_brand[brand_name] = products
+        print(f"Загружено {len(products)} продуктов для {brand_name}.")
+
+    return products_by_brand
+
+def _external_feed_fingerprint():
+    """
+    Отпечаток внешнего XML: валидаторы сервера, а если он их не прислал -
+    sha256 кешированного файла, чтобы смена картинок не осталась незамеченной.
+    """
+    meta = _load_external_feed_meta()
+    fingerprint = meta.get("etag", "") + meta.get("last_modified", "")
+    if fingerprint:
+        return fingerprint
+
+    try:
+        digest = hashlib.sha256()
+        with open(EXTERNAL_FEED_CACHE, "rb") as f:
+            for chunk in iter(lambda: f.read(65536), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+    except OSError:
+        return ""
+
+def _feed_signature():
+    """
+    Сводный хеш входных данных фида: ответы API плюс отпечаток внешнего XML.
+    Совпал с прошлым запуском - значит и feed.xml получился бы тем же.
+    """
+    state = _load_api_state()
+    parts = [state.get(u, {}).get("hash", "") for u in (CATEGORIES_API_URL, *PRODUCTS_API.values())]
+    parts.append(_external_feed_fingerprint())
+    return "|".join(parts)
 
 # ==============================================================================
 # ФУНКЦИЯ ДЛЯ ГЕНЕРАЦИИ XML-ФИДА
 # ==============================================================================
+# Куски offer-а, одинаковые для каждого продукта — готовые строки,
+# не пересобираем в цикле
+OFFER_STATIC_FIELDS = "<vat>7</vat><step-quantity>1</step-quantity><preorder>1</preorder>"
+# brand/vendor по источнику: один hash-lookup вместо ветвления по строкам
+BRAND_MAP = {"Unimat": ("Unimat", "Unimat")}
+DEFAULT_BRAND = ("Prompower", "Prompower")
+WAREHOUSE_OPEN = '<warehouse name="Главный склад Prompower и Unimat" unit="шт">' 
+
+def _write_text_element(xf, tag, text):
+    """
+    Пишет простой элемент <tag>text</tag> в инкрементальный writer.
+    """
+    element = ET.Element(tag)
+    element.text = text
+    xf.write(element)
+
 def generate_xml_feed(products_list, categories_data, images_map):
     """
     Преобразует полученные данные в XML-формат.
     """
-    # 1. Создание корневого элемента и тега shop
-    root = ET.Element("yml_catalog", date=datetime.now().strftime("%Y-%m-%d %H:%M"))
-    shop = ET.SubElement(root, "shop")
-
-    # Информация о магазине
-    ET.SubElement(shop, "name").text = "Prompower"
-    ET.SubElement(shop, "company").text = "Мотрум"
-    ET.SubElement(shop, "url").text = "https://brilka.github.io/prompower-feed/" 
-
-    # 2. Создание категорий (Categories)
-    categories_element = ET.SubElement(shop, "categories")
-    
-    if isinstance(categories_data, list):
-        for category in categories_data:
-            category_id = str(category.get("id"))
-            category_title = category.get("title")
-            
-            if category_id and category_title:
-                ET.SubElement(categories_element, "category", id=category_id).text = category_title
-
-    # 3. Создание списка предложений (offers)
-    offers = ET.SubElement(shop, "offers")
-    
     # Счетчик добавленных товаров
     added_count = 0
-    
-    for product in products_list:
-        
-        offer_id_or_article = product.get("article")
-        
-        if not offer_id_or_article:
-            continue
-            
-        # --- ФИЛЬТРАЦИЯ ПО ЦЕНЕ ---
-        try:
-            price_value = float(product.get("price", 0))
-        except (ValueError, TypeError):
-            price_value = 0
 
-        # Если цена 0 или меньше, пропускаем
-        if price_value <= 0:
-            continue
-        # --------------------------
+    # Пишем во временный файл и подменяем feed.xml только после успешной
+    # генерации: упавший запуск не затирает прошлый рабочий фид
+    tmp_path = "feed.xml.tmp"
 
-        offer_id = str(offer_id_or_article)
-        offer = ET.SubElement(offers, "offer", id=offer_id)
-        added_count += 1
+    # Пишем XML инкрементально и без форматирования: фид читают машины,
+    # отступы и переводы строк только раздувают файл
+    with ET.xmlfile(tmp_path, encoding="utf-8") as xf:
+        xf.write_declaration()
 
-        # 3.1. Обязательные поля
-        
-        ET.SubElement(offer, "vendorCode").text = offer_id
-        ET.SubElement(offer, "name").text = product.get("title", f"Продукт {offer_id}")
-        ET.SubElement(offer, "categoryId").text = str(product.get("categoryId", "10")) 
-        ET.SubElement(offer, "price").text = str(product.get("price", 0))
-        ET.SubElement(offer, "vat").text = "7" 
-        ET.SubElement(offer, "step-quantity").text = "1"
-        ET.SubElement(offer, "preorder").text = "1" 
-
-        # 3.2. Настройка brand и vendor
-        source_brand = product.get('source_brand', 'Prompower')
-        
-        if source_brand == "Unimat":
-            brand_name = "Unimat"
-            vendor_name = "Unimat"
-        else:
-            brand_name = "Prompower"
-            vendor_name = "Prompower"
-            
-        ET.SubElement(offer, "brand").text = brand_name
-        ET.SubElement(offer, "vendor").text = vendor_name
-
-        # 3.3. Остальные поля
-        
-        # --- ИЗОБРАЖЕНИЕ (ИЗ ВНЕШНЕГО XML) ---
-        # Пытаемся найти URL картинки в словаре images_map по offer_id (артикулу)
-        external_image = images_map.get(offer_id)
-        
-        if external_image:
-            # Если нашли во внешнем XML - используем его (приоритет)
-            ET.SubElement(offer, "picture").text = external_image
-        else:
-            # Если не нашли, пробуем взять из API как запасной вариант
-            api_image = product.get("picture", product.get("image"))
-            if api_image:
-                ET.SubElement(offer, "picture").text = api_image
-        # -------------------------------------
-
-        # description
-        description = product.get("description")
-        if description:
-            ET.SubElement(offer, "description").text = description 
-
-        # warehouse
-        quantity = int(product.get("instock", 0))
-        warehouse = ET.SubElement(offer, "warehouse", name="Главный склад Prompower и Unimat", unit="шт")
-        warehouse.text = str(quantity)
-        
-        # param Вес
-        weight = product.get("weight")
-        if weight:
-             ET.SubElement(offer, "param", name="Вес", unit="кг").text = str(weight)
-        
-        # param Габариты
-        height = product.get("height")
-        width = product.get("width")
-        depth = product.get("depth")
-        
-        if height and width and depth:
-             dimensions = f"{height}x{width}x{depth}"
-             ET.SubElement(offer, "param", name="Габариты", unit="мм").text = dimensions
-        
-    # 4. Форматирование и запись
-    rough_string = ET.tostring(root, 'utf-8')
-    reparsed = minidom.parseString(rough_string)
-    pretty_xml_as_string = reparsed.toprettyxml(indent="  ", encoding="utf-8").decode('utf-8')
-    
-    pretty_xml_as_string = '\n'.join([line for line in pretty_xml_as_string.split('\n') if line.strip()])
-
-    with open("feed.xml", "w", encoding="utf-8") as f:
-        f.write(pretty_xml_as_string)
-    
+        # 1. Корневой элемент и тег shop
+        with xf.element("yml_catalog", date=datetime.now().strftime("%Y-%m-%d %H:%M")):
+            with xf.element("shop"):
+                # Информация о магазине
+                _write_text_element(xf, "name", "Prompower")
+                _write_text_element(xf, "company", "Мотрум")
+                _write_text_element(xf, "url", "https://brilka.github.io/prompower-feed/")
+
+                # 2. Создание категорий (Categories)
+                with xf.element("categories"):
+                    # Duck typing вместо isinstance: в нормальном случае это
+                    # список словарей, try/except на успешном пути почти бесплатен
+                    try:
+                        attrs = {}
+                        for category in categories_data:
+                            category_id = category.get("id")
+                            category_title = category.get("title")
+
+                            if not (category_id and category_title):
+                                continue
+
+                            # lxml копирует attrib в элемент, поэтому один словарь
+                            # можно переиспользовать, перезаписывая только id
+                            attrs["id"] = str(category_id)
+                            category_element = ET.Element("category", attrs)
+                            category_element.text = category_title
+                            xf.write(category_element)
+                    except (TypeError, AttributeError):
+                        print(f"Неожиданный формат категорий: {type(categories_data).__name__}. Пропускаем.")
+
+                # 3. Создание списка предложений (offers)
+                with xf.element("offers"):
+                    for source_brand, product in products_list:
+                        offer = _build_offer(product, source_brand, images_map)
+                        if offer is None:
+                            continue
+
+                        xf.write(offer)
+                        added_count += 1
+
+    os.replace(tmp_path, "feed.xml")
     print(f"Файл feed.xml успешно сгенерирован. Добавлено товаров: {added_count}")
+    return added_count
+
+def _build_offer(product, source_brand, images_map,
+                 # Специализация под фиксированную схему: все горячие глобалы
+                 # заморожены в локалы по умолчанию еще при создании функции
+                 _escape=xml_escape, _quoteattr=quoteattr, _intern=sys.intern,
+                 _fromstring=ET.fromstring, _brand=BRAND_MAP.get):
+    """
+    Собирает элемент <offer> для одного продукта.
+    Возвращает None, если продукт не проходит фильтры (нет артикула или цены).
+    """
+    offer_id_or_article = product.article
+
+    if not offer_id_or_article:
+        return None
+
+    # --- ФИЛЬТРАЦИЯ ПО ЦЕНЕ ---
+    try:
+        price_value = float(product.price)
+    except (ValueError, TypeError):
+        price_value = 0
+
+    # Если цена 0 или меньше, пропускаем
+    if price_value <= 0:
+        return None
+    # --------------------------
+
+    # Артикул используется как id оффера, vendorCode и ключ в images_map —
+    # интернируем, чтобы все употребления делили один объект строки
+    offer_id = _intern(str(offer_id_or_article))
+
+    # 3.2. Настройка brand и vendor
+    brand_name, vendor_name = _brand(source_brand, DEFAULT_BRAND)
+
+    # Собираем offer одной f-строкой и разбираем C-парсером: одна укладка
+    # строки вместо ~15 вызовов SubElement на каждый продукт
+    escaped_id = _escape(offer_id)
+    name = product.title or f"Продукт {offer_id}"
+
+    # API обычно уже отдает строки — не гоняем значения через int()/str() впустую
+    price = product.price
+    price_text = price if isinstance(price, str) else str(price)
+    category_id = product.categoryId
+    if category_id is None:
+        category_id = "10"
+    instock = product.instock
+    if instock is None:
+        quantity_text = "0"
+    elif isinstance(instock, str):
+        quantity_text = instock.strip() or "0"
+    elif isinstance(instock, float):
+        quantity_text = str(int(instock)) # склад целочисленный: 5.0 -> "5"
+    else:
+        quantity_text = str(instock)
+
+    parts = [
+        # 3.1. Обязательные поля
+        f'<offer id={_quoteattr(offer_id)}>'
+        f'<vendorCode>{escaped_id}</vendorCode>'
+        f'<name>{_escape(name)}</name>'
+        f'<categoryId>{_escape(str(category_id))}</categoryId>'
+        f'<price>{_escape(price_text)}</price>'
+        + OFFER_STATIC_FIELDS +
+        f'<brand>{brand_name}</brand>'
+        f'<vendor>{vendor_name}</vendor>'
+    ]
+
+    # 3.3. Остальные поля
+
+    # --- ИЗОБРАЖЕНИЕ (ИЗ ВНЕШНЕГО XML) ---
+    # Пытаемся найти URL картинки в словаре images_map по offer_id (артикулу)
+    # (приоритет у внешнего XML, картинка из API - запасной вариант)
+    picture = images_map.get(offer_id) or product.picture or product.image
+    if picture:
+        parts.append(f'<picture>{_escape(picture)}</picture>')
+
+    # description
+    description = product.description
+    if description:
+        parts.append(f'<description>{_escape(description)}</description>')
+
+    # warehouse
+    parts.append(f'{WAREHOUSE_OPEN}{_escape(quantity_text)}</warehouse>')
+
+    # param Вес
+    weight = product.weight
+    if weight:
+        parts.append(f'<param name="Вес" unit="кг">{_escape(str(weight))}</param>')
+
+    # param Габариты: один кортеж, одна проверка, одно %-форматирование
+    hwd = (product.height, product.width, product.depth)
+    if all(hwd):
+        parts.append(f'<param name="Габариты" unit="мм">{_escape("%sx%sx%s" % hwd)}</param>')
+
+    parts.append('</offer>')
+    return _fromstring("".join(parts))
 
 # ==============================================================================
 # ОСНОВНАЯ ЛОГИКА ЗАПУСКА
 # ==============================================================================
 if __name__ == "__main__":
-    # 1. Получаем список категорий
-    categories = fetch_data(CATEGORIES_API_URL, is_post=False)
+    # 1-3. Все запросы независимы (разные endpoint-ы), поэтому запускаем их
+    # параллельно: общее время = самый медленный запрос, а не сумма всех.
+    # Продукты могут прийти и из дискового кеша — тогда поток отработает мгновенно.
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        categories_future = executor.submit(fetch_data, CATEGORIES_API_URL)
+        images_future = executor.submit(fetch_external_images_map)
+        brand_futures = {
+            brand_name: executor.submit(fetch_products, api_url)
+            for brand_name, api_url in PRODUCTS_API.items()
+        }
+
+        categories = categories_future.result()
+        images_map = images_future.result()
+        products_by_brand = fetch_all_products(brand_futures)
+
     if not categories:
         print("Не удалось получить категории. Завершение.")
         exit(1)
 
-    # 2. Получаем словарь картинок из внешнего XML (Prompower feed)
-    images_map = fetch_external_images_map()
-        
-    # 3. Получаем список всех товаров (API)
-    all_products = fetch_all_products()
-    if not all_products:
+    # Как и раньше, не трогаем существующий feed.xml, если продуктов нет совсем
+    if not any(products_by_brand.values()):
         print("Не удалось получить ни одного продукта. Завершение.")
         exit(1)
-        
-    # 4. Генерируем XML (передаем и продукты, и категории, и словарь картинок)
-    generate_xml_feed(all_products, categories, images_map)
+
+    # Если все входные данные совпадают с прошлой генерацией,
+    # перегенерировать XML незачем
+    signature = _feed_signature()
+    state = _load_api_state()
+    if signature == state.get("last_feed_signature") and os.path.exists("feed.xml"):
+        print("Входные данные не изменились — feed.xml оставляем как есть.")
+        exit(0)
+
+    # 4. Генерируем XML: бренд идет рядом с продуктом, сами структуры не трогаем
+    tagged_products = (
+        (brand_name, product)
+        for brand_name, products in products_by_brand.items()
+        for product in products
+    )
+    generate_xml_feed(tagged_products, categories, images_map)
+
+    # Запоминаем, из каких данных собран текущий feed.xml
+    state["last_feed_signature"] = signature
+    _save_api_state(state)